@@ -5,7 +5,9 @@
 """
 from __future__ import print_function
 
-FILTER = bytearray([ (i < 32 or i > 127) and 46 or i for i in range(256) ])
+import binascii
+
+FILTER = bytes(bytearray([ (i < 32 or i > 127) and 46 or i for i in range(256) ]))
 
 def hexdump(src, length=16, prefix=''):
     """
@@ -19,23 +21,27 @@ def hexdump(src, length=16, prefix=''):
     0010  10 11 12 13 14 15 16 17  18 19 1a 1b 1c 1d 1e 1f  ........ ........
     0020  20 21 22 23 24 25 26 27  28 29 2a 2b 2c 2d 2e 2f   !"#$%&' ()*+,-./
 
+    >>> print(hexdump(b"abcdefghij"))
+    0000  61 62 63 64 65 66 67 68  69 6a                    abcdefgh ij
+
     """
-    n = 0
     left = length // 2
     right = length - left
-    result= []
-    src = bytearray(src)
-    while src:
-        s,src = src[:length],src[length:]
-        l,r = s[:left],s[left:]
-        hexa = "%-*s" % (left*3,' '.join(["%02x"%x for x in l]))
-        hexb = "%-*s" % (right*3,' '.join(["%02x"%x for x in r]))
-        lf = l.translate(FILTER)
-        rf = r.translate(FILTER)
-        result.append("%s%04x  %s %s %s %s" % (prefix, n, hexa, hexb,
-                                               lf.decode(), rf.decode()))
-        n += length
-    return "\n".join(result)
+    src = bytes(src)
+    # Hex encode/filter printable chars for whole buffer once
+    hexall = binascii.hexlify(src).decode()
+    textall = src.translate(FILTER).decode()
+    def hexcol(start,end):
+        end = min(end,len(src))
+        return " ".join([ hexall[i:i+2] for i in range(2*start,2*end,2) ])
+    def lines():
+        for n in range(0,len(src),length):
+            yield "%s%04x  %-*s %-*s %s %s" % (prefix, n,
+                                               left*3, hexcol(n,n+left),
+                                               right*3, hexcol(n+left,n+length),
+                                               textall[n:n+left],
+                                               textall[n+left:n+length])
+    return "\n".join(lines())
 
 def get_bits(data,offset,bits=1):
     """
@@ -76,12 +82,16 @@ def binary(n,count=16,reverse=False):
         '10000101'
         >>> binary(6789,reverse=True)
         '1010000101011000'
+        >>> binary(6789,0)
+        ''
 
     """
-    bits = [str((n >> y) & 1) for y in range(count-1, -1, -1)]
+    if count <= 0:
+        return ""
+    bits = format(n & ((1 << count) - 1), "0%db" % count)
     if reverse:
-        bits.reverse()
-    return "".join(bits)
+        return bits[::-1]
+    return bits
 
 if __name__ == '__main__':
     import doctest,sys
@@ -55,13 +55,20 @@ class Buffer(object):
         """
         return len(self.data) - self.offset
 
-    def get(self,length):
+    def check(self,length):
         """
-            Gen len bytes at current offset (& increment offset)
+            Check len bytes available at current offset (raises
+            BufferError if not)
         """
         if length > self.remaining():
             raise BufferError("Not enough bytes [offset=%d,remaining=%d,requested=%d]" %
                     (self.offset,self.remaining(),length))
+
+    def get(self,length):
+        """
+            Gen len bytes at current offset (& increment offset)
+        """
+        self.check(length)
         start = self.offset
         end = self.offset + length
         self.offset += length
@@ -20,6 +20,7 @@ except ImportError:
 
 import binascii,code,pprint,sys
 
+from dnslib.buffer import Buffer
 from dnslib.dns import DNSRecord,DNSHeader,DNSQuestion,DNSError,QTYPE,EDNS0
 from dnslib.digparser import DigParser
 
@@ -74,15 +75,16 @@ if __name__ == '__main__':
             print()
 
         a_pkt = q.send(address,port,tcp=args.tcp)
-        a = DNSRecord.parse(a_pkt)
+        # Only parse header until we know we have the final response
+        a_header = DNSHeader.parse(Buffer(a_pkt))
 
-        if q.header.id != a.header.id:
+        if q.header.id != a_header.id:
             raise DNSError('Response transaction id does not match query transaction id')
 
-        if a.header.tc and args.noretry == False:
+        if a_header.tc and args.noretry == False:
             # Truncated - retry in TCP mode
             a_pkt = q.send(address,port,tcp=True)
-            a = DNSRecord.parse(a_pkt)
+        a = DNSRecord.parse(a_pkt)
 
         if args.dig or args.diff:
             if args.diff:
@@ -108,10 +110,9 @@ if __name__ == '__main__':
                                                  getattr(QTYPE,args.qtype)))
                 q_diff = q
                 diff = q_diff.send(address,port,tcp=args.tcp)
-                a_diff = DNSRecord.parse(diff)
-                if a_diff.header.tc and args.noretry == False:
+                if DNSHeader.parse(Buffer(diff)).tc and args.noretry == False:
                     diff = q_diff.send(address,port,tcp=True)
-                    a_diff = DNSRecord.parse(diff)
+                a_diff = DNSRecord.parse(diff)
 
         if args.short:
             print(a.short())
@@ -6,17 +6,44 @@
 
 from __future__ import print_function
 
-import fnmatch,re,string
+import fnmatch,re,string,struct
 
-from dnslib.bit import get_bits,set_bits
 from dnslib.buffer import Buffer, BufferError
 
 # In theory valid label characters should be letters,digits,hyphen,underscore (LDH)
 # LDH = set(bytearray(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'))
 # For compatibility we only escape non-printable characters
-LDH = set(range(33,127))
+LDH = frozenset(range(33,127))
+# All LDH bytes (used to check label with a single bytes.translate call)
+_LDH_BYTES = bytes(bytearray(sorted(LDH)))
+# Matches non-LDH chars in latin-1 decoded label (escaped as \NNN)
+_NON_LDH = re.compile(u'[^\x21-\x7e]')
+# Escaped form of each byte value
+_ESC = tuple([ chr(c) if c in LDH else "\\%03d" % c for c in range(256) ])
 ESCAPE = re.compile(r'\\([0-9][0-9][0-9])')
 
+# Precompiled struct formats for label length/pointer fields
+_U8 = struct.Struct("!B").unpack_from
+_U16 = struct.Struct("!H").unpack_from
+_P8 = struct.Struct("!B").pack
+_P16 = struct.Struct("!H").pack
+
+# Compiled regex cache for DNSLabel.matchGlob (pattern -> regex)
+_GLOB_CACHE = {}
+_GLOB_CACHE_MAX = 1024
+
+def _glob_regex(pattern):
+    """
+        Return compiled regex for glob pattern (cached)
+    """
+    try:
+        return _GLOB_CACHE[pattern]
+    except KeyError:
+        if len(_GLOB_CACHE) >= _GLOB_CACHE_MAX:
+            _GLOB_CACHE.clear()
+        regex = _GLOB_CACHE[pattern] = re.compile(fnmatch.translate(pattern))
+        return regex
+
 class DNSLabelError(Exception):
     pass
 
@@ -43,6 +70,8 @@ class DNSLabel(object):
     <DNSLabel: 'aaa.bbb.ccc.'>
     >>> str(l1)
     'aaa.bbb.ccc.'
+    >>> print(DNSLabel([b"aaa bbb",b"ccc"]))
+    aaa\\032bbb.ccc.
     >>> l3 = l1.add("xxx.yyy")
     >>> l3
     <DNSLabel: 'xxx.yyy.aaa.bbb.ccc.'>
@@ -79,6 +108,9 @@ class DNSLabel(object):
         """
         if type(label) == DNSLabel:
             self.label = label.label
+            self._lower = label._lower
+            self._str = label._str
+            return
         elif type(label) in (list,tuple):
             self.label = tuple(label)
         else:
@@ -95,6 +127,22 @@ class DNSLabel(object):
                     # Py2
                     label = ESCAPE.sub(lambda m:chr(int(m.groups()[0])),label)
                 self.label = tuple(label.rstrip(b".").split(b"."))
+        # Cache lowercased components for case-insensitive hash/compare
+        self._lower = tuple([ l.lower() for l in self.label ])
+        # String form (created lazily by __str__)
+        self._str = None
+
+    @classmethod
+    def _from_labels(cls,labels):
+        """
+            Create DNS label directly from a tuple of byte strings
+            (bypasses type checks/IDNA encoding in __init__)
+        """
+        obj = cls.__new__(cls)
+        obj.label = labels
+        obj._lower = tuple([ l.lower() for l in labels ])
+        obj._str = None
+        return obj
 
     def add(self,name):
         """
@@ -102,20 +150,20 @@ class DNSLabel(object):
         """
         new = DNSLabel(name)
         if self.label:
-            new.label += self.label
+            new = DNSLabel._from_labels(new.label + self.label)
         return new
 
     def matchGlob(self,pattern):
         if type(pattern) != DNSLabel:
             pattern = DNSLabel(pattern)
-        return fnmatch.fnmatch(str(self).lower(),str(pattern).lower())
+        return _glob_regex(str(pattern).lower()).match(str(self).lower()) is not None
 
     def matchSuffix(self,suffix):
         """
             Return True if label suffix matches
         """
         suffix = DNSLabel(suffix)
-        return DNSLabel(self.label[-len(suffix.label):]) == suffix
+        return self._lower[-len(suffix._lower):] == suffix._lower
 
     def stripSuffix(self,suffix):
         """
@@ -123,7 +171,7 @@ class DNSLabel(object):
         """
         suffix = DNSLabel(suffix)
         if self.matchSuffix(suffix):
-            return DNSLabel(self.label[:-len(suffix.label)])
+            return DNSLabel._from_labels(self.label[:-len(suffix.label)])
         else:
             return self
 
@@ -131,31 +179,37 @@ class DNSLabel(object):
         return ".".join([ s.decode("idna") for s in self.label ]) + "."
 
     def _decode(self,s):
-        if set(s).issubset(LDH):
+        if not s.translate(None,_LDH_BYTES):
             # All chars in LDH
             return s.decode()
         else:
             # Need to encode
-            return "".join([(chr(c) if (c in LDH) else "\\%03d" % c) for c in s])
+            return _NON_LDH.sub(lambda m:_ESC[ord(m.group())],
+                                s.decode("latin-1"))
 
     def __str__(self):
-        return ".".join([ self._decode(bytearray(s)) for s in self.label ]) + "."
+        if self._str is None:
+            self._str = ".".join([ self._decode(s) for s in self.label ]) + "."
+        return self._str
 
     def __repr__(self):
         return "<DNSLabel: '%s'>" % str(self)
 
     def __hash__(self):
-        return hash(tuple(map(lambda x:x.lower(),self.label)))
+        return hash(self._lower)
 
     def __ne__(self,other):
         return not self == other
 
     def __eq__(self,other):
-        if type(other) != DNSLabel:
-            return self.__eq__(DNSLabel(other))
+        if type(other) is DNSLabel:
+            if self is other:
+                return True
+            if len(self._lower) != len(other._lower):
+                return False
+            return self._lower == other._lower
         else:
-            return [ l.lower() for l in self.label ] == \
-                   [ l.lower() for l in other.label ]
+            return self.__eq__(DNSLabel(other))
 
     def __len__(self):
         return len(b'.'.join(self.label))
@@ -205,6 +259,13 @@ class DNSBuffer(Buffer):
     >>> len(b.decode_name().label)
     3
 
+    >>> b = DNSBuffer(b"\\x01a\\xc0\\x00")
+    >>> try:
+    ...     b.decode_name()
+    ... except BufferError as e:
+    ...     print(e)
+    Recursive pointer in DNSLabel [offset=4,pointer=0,length=4]
+
     >>> b = DNSBuffer()
     >>> b.encode_name_nocompress(b'aaa.bbb.ccc.')
     >>> len(b)
@@ -221,38 +282,54 @@ class DNSBuffer(Buffer):
 
     def __init__(self,data=b''):
         """
-            Add 'names' dict to cache stored labels
+            Add 'names' dict to cache stored labels and '_name_cache'
+            dict to cache decoded labels (offset -> (label,next_offset))
         """
         super(DNSBuffer,self).__init__(data)
         self.names = {}
+        self._name_cache = {}
 
-    def decode_name(self,last=-1):
+    def decode_name(self):
         """
             Decode label at current offset in buffer (following pointers
             to cached elements where necessary)
         """
+        start = self.offset
+        if start in self._name_cache:
+            name,self.offset = self._name_cache[start]
+            return name
         label = []
-        done = False
-        while not done:
-            (length,) = self.unpack("!B")
-            if get_bits(length,6,2) == 3:
+        # Names decoded (start offset + pointer targets) as
+        # [offset,index into label,next_offset] - these are all cached
+        names = [[start,0,None]]
+        # Pointers already followed (detect loops)
+        visited = set()
+        while True:
+            self.check(1)
+            (length,) = _U8(self.data,self.offset)
+            if length & 0xC0 == 0xC0:
                 # Pointer
-                self.offset -= 1
-                pointer = get_bits(self.unpack("!H")[0],0,14)
-                save = self.offset
-                if last == save:
+                self.check(2)
+                pointer = _U16(self.data,self.offset)[0] & 0x3FFF
+                self.offset += 2
+                if self.offset in visited:
                     raise BufferError("Recursive pointer in DNSLabel [offset=%d,pointer=%d,length=%d]" %
                             (self.offset,pointer,len(self.data)))
-                if pointer < self.offset:
-                    self.offset = pointer
-                else:
+                if pointer >= self.offset:
                     # Pointer can't point forwards
                     raise BufferError("Invalid pointer in DNSLabel [offset=%d,pointer=%d,length=%d]" %
                             (self.offset,pointer,len(self.data)))
-                label.extend(self.decode_name(save).label)
-                self.offset = save
-                done = True
+                visited.add(self.offset)
+                for n in names:
+                    if n[2] is None:
+                        n[2] = self.offset
+                if pointer in self._name_cache:
+                    label.extend(self._name_cache[pointer][0].label)
+                    break
+                names.append([pointer,len(label),None])
+                self.offset = pointer
             else:
+                self.offset += 1
                 if length > 0:
                     l = self.get(length)
                     try:
@@ -261,8 +338,16 @@ class DNSBuffer(Buffer):
                         raise BufferError("Invalid label <%s>" % l)
                     label.append(l)
                 else:
-                    done = True
-        return DNSLabel(label)
+                    break
+        for n in names:
+            if n[2] is None:
+                n[2] = self.offset
+        label = tuple(label)
+        for offset,index,next_offset in names:
+            self._name_cache[offset] = (DNSLabel._from_labels(label[index:]),
+                                        next_offset)
+        name,self.offset = self._name_cache[start]
+        return name
 
     def encode_name(self,name):
         """
@@ -274,22 +359,31 @@ class DNSBuffer(Buffer):
             name = DNSLabel(name)
         if len(name) > 253:
             raise DNSLabelError("Domain label too long: %r" % name)
-        name = list(name.label)
-        while name:
-            if tuple(name) in self.names:
+        labels = name.label
+        # Build encoded name and append in one go (only update 'names'
+        # once complete so that we don't cache a partially encoded name)
+        chunks = []
+        names = []
+        offset = self.offset
+        for i in range(len(labels)):
+            key = labels[i:]
+            if key in self.names:
                 # Cached - set pointer
-                pointer = self.names[tuple(name)]
-                pointer = set_bits(pointer,3,14,2)
-                self.pack("!H",pointer)
-                return
+                pointer = self.names[key]
+                pointer = pointer | 0xC000
+                chunks.append(_P16(pointer))
+                break
             else:
-                self.names[tuple(name)] = self.offset
-                element = name.pop(0)
+                names.append((key,offset))
+                element = labels[i]
                 if len(element) > 63:
                     raise DNSLabelError("Label component too long: %r" % element)
-                self.pack("!B",len(element))
-                self.append(element)
-        self.append(b'\x00')
+                chunks.append(_P8(len(element)) + element)
+                offset += len(element) + 1
+        else:
+            chunks.append(b'\x00')
+        self.names.update(names)
+        self.append(b''.join(chunks))
 
     def encode_name_nocompress(self,name):
         """
@@ -300,14 +394,13 @@ class DNSBuffer(Buffer):
             name = DNSLabel(name)
         if len(name) > 253:
             raise DNSLabelError("Domain label too long: %r" % name)
-        name = list(name.label)
-        while name:
-            element = name.pop(0)
+        chunks = []
+        for element in name.label:
             if len(element) > 63:
                 raise DNSLabelError("Label component too long: %r" % element)
-            self.pack("!B",len(element))
-            self.append(element)
-        self.append(b'\x00')
+            chunks.append(_P8(len(element)) + element)
+        chunks.append(b'\x00')
+        self.append(b''.join(chunks))
 
 if __name__ == '__main__':
     import doctest,sys
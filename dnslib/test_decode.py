@@ -49,10 +49,11 @@
 
 from __future__ import print_function
 
-from dnslib.dns import DNSRecord,EDNS0
+from dnslib.buffer import Buffer
+from dnslib.dns import DNSRecord,DNSHeader,EDNS0
 from dnslib.digparser import DigParser
 
-import argparse,binascii,code,glob,os,os.path,sys,unittest
+import argparse,binascii,code,glob,multiprocessing,os,os.path,sys,traceback,unittest
 
 try:
     from subprocess import getoutput
@@ -74,11 +75,11 @@ def new_test(domain,qtype,address="8.8.8.8",port=53,nodig=False,dnssec=False):
         q.add_ar(EDNS0(flags="do",udp_len=4096))
         q.header.ad = 1
     a_pkt = q.send(address,port)
-    a = DNSRecord.parse(a_pkt)
-    if a.header.tc:
+    # Only parse header until we know we have the final response
+    if DNSHeader.parse(Buffer(a_pkt)).tc:
         tcp = True
         a_pkt = q.send(address,port,tcp)
-        a = DNSRecord.parse(a_pkt)
+    a = DNSRecord.parse(a_pkt)
 
     if not nodig:
         if dnssec:
@@ -124,6 +125,23 @@ def new_test(domain,qtype,address="8.8.8.8",port=53,nodig=False,dnssec=False):
         print(a,file=f)
         print(file=f)
 
+def check_pack(data,pack):
+    """
+        Check repacked data matches original
+
+        We occasionally get issues where original packet did not
+        compress all labels - in this case (only if the packed data
+        is shorter) we reparse the packed record, repack this and
+        compare with the packed data
+    """
+    if pack == data:
+        return True
+    elif len(pack) < len(data):
+        # Shorter - possibly compression difference
+        return DNSRecord.parse(pack).pack() == pack
+    else:
+        return False
+
 def check_decode(f,debug=False):
     errors = []
 
@@ -154,23 +172,11 @@ def check_decode(f,debug=False):
     qpack = qparse.pack()
     rpack = rparse.pack()
 
-    # Check if repacked question data matches original
-    # We occasionally get issues where original packet did not
-    # compress all labels - in this case we reparse packed
-    # record, repack this and compare with the packed data
-    if qpack != qdata:
-        if len(qpack) < len(qdata):
-            # Shorter - possibly compression difference
-            if DNSRecord.parse(qpack).pack() != qpack:
-                errors.append(('Question Pack',(qdata,qpack)))
-        else:
-            errors.append(('Question Pack',(qdata,qpack)))
-    if rpack != rdata:
-        if len(rpack) < len(rdata):
-            if DNSRecord.parse(rpack).pack() != rpack:
-                errors.append(('Reply Pack',(rdata,rpack)))
-        else:
-            errors.append(('Reply Pack',(rdata,rpack)))
+    # Check if repacked data matches original
+    if not check_pack(qdata,qpack):
+        errors.append(('Question Pack',(qdata,qpack)))
+    if not check_pack(rdata,rpack):
+        errors.append(('Reply Pack',(rdata,rpack)))
 
     if debug:
         if errors:
@@ -185,9 +191,35 @@ def check_decode(f,debug=False):
 
     return errors
 
+def check_decode_worker(f):
+    """
+        Run check_decode in worker process - any exception is returned
+        as an 'Exception' error (with traceback) so that a single bad
+        file doesn't abort the other checks
+    """
+    try:
+        return check_decode(f)
+    except Exception:
+        return [('Exception',traceback.format_exc())]
+
+def check_decode_all(files):
+    """
+        Run check_decode for each file using a process pool
+        (returns dict of filename -> errors)
+    """
+    pool = multiprocessing.Pool()
+    try:
+        return dict(zip(files,pool.map(check_decode_worker,files)))
+    finally:
+        pool.close()
+        pool.join()
+
 def print_errors(errors):
     for err,err_data in errors:
-        if err == 'Question':
+        if err == 'Exception':
+            print("Exception:")
+            print(err_data)
+        elif err == 'Question':
             print("Question error:")
             for (d1,d2) in err_data:
                 if d1:
@@ -214,9 +246,17 @@ def print_errors(errors):
             print("RPACK:",binascii.hexlify(err_data[1]))
             print(DNSRecord.parse(err_data[1]))
 
-def test_generator(f):
+def test_generator(f,results):
     def test(self):
-        self.assertEqual(check_decode(f),[])
+        # Use precomputed results if available
+        if f in results:
+            errors = results[f]
+        else:
+            errors = check_decode(f)
+        for err,err_data in errors:
+            if err == 'Exception':
+                raise RuntimeError("Exception in check_decode:\n%s" % err_data)
+        self.assertEqual(errors,[])
     return test
 
 if __name__ == '__main__':
@@ -263,23 +303,34 @@ if __name__ == '__main__':
         if args.new:
             new_test(*args.new,nodig=args.nodig,dnssec=args.dnssec)
         elif args.interactive:
-            for f in glob.iglob(args.glob):
-                if os.path.isfile(f):
+            files = [ f for f in glob.iglob(args.glob) if os.path.isfile(f) ]
+            if args.debug:
+                # Debug mode is interactive so run serially
+                for f in files:
                     print("-- %s: " % f,end='')
-                    e = check_decode(f,args.debug)
-                    if not args.debug:
-                        if e:
-                            print("ERROR\n")
-                            print_errors(e)
-                            print()
-                        else:
-                            print("OK")
+                    check_decode(f,args.debug)
+            else:
+                results = check_decode_all(files)
+                for f in files:
+                    print("-- %s: " % f,end='')
+                    e = results[f]
+                    if e:
+                        print("ERROR\n")
+                        print_errors(e)
+                        print()
+                    else:
+                        print("OK")
         elif args.unittest:
-            for f in glob.iglob(args.glob):
-                if os.path.isfile(f):
-                    test_name = 'test_%s' % f
-                    test = test_generator(f)
-                    setattr(TestContainer,test_name,test)
+            files = [ f for f in glob.iglob(args.glob) if os.path.isfile(f) ]
+            if args.failfast:
+                # Run checks serially (in tests) so we stop at first failure
+                results = {}
+            else:
+                results = check_decode_all(files)
+            for f in files:
+                test_name = 'test_%s' % f
+                test = test_generator(f,results)
+                setattr(TestContainer,test_name,test)
             unittest.main(argv=[__name__],
                           verbosity=2 if args.verbose else 1,
                           failfast=args.failfast)